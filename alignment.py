@@ -124,19 +124,16 @@ def read_align_file(align_file, max_align=-1, a_type=ALIGN_METEOR):
     return alignments
 
 
-def cmp_score_best(x, y):
-    diff = (x[0].score - x[1].score) - (y[0].score - y[1].score)
-    return -1 if diff > 0 else 1 if diff < 0 else 0
+def key_score_best(x):
+    return x[1].score - x[0].score
 
 
-def cmp_score_diff(x, y):
-    diff = abs(x[0].score - x[1].score) - abs(y[0].score - y[1].score)
-    return 1 if diff > 0 else -1 if diff < 0 else 0
+def key_score_diff(x):
+    return abs(x[0].score - x[1].score)
 
 
-def cmp_score(x, y):
-    diff = x.score - y.score
-    return 1 if diff > 0 else -1 if diff < 0 else 0
+def key_score(x):
+    return x.score
 
 
 def get_score_dist(scores, size=10):
@@ -1,11 +1,10 @@
 #!/usr/bin/env python
 
 import os
-import re
 import sys
 import shutil
-import tempfile
 import subprocess
+from functools import lru_cache
 
 from alignment import read_align_file, ALIGN_DEFAULT, ALIGN_METEOR, NO_MATCH
 
@@ -161,24 +160,39 @@ FILL = {'ex': r'\mex', 'ap': r'\map', 'rm': r'\mrm'}
 FILL_L = {'ex': r'\lex', 'ap': r'\lap'}
 FILL_R = {'ex': r'\rex', 'ap': r'\rap'}
 
+# LaTeX special characters, escaped in a single pass by escape()
+_ESCAPE_TABLE = str.maketrans({'\\': r'\backslash', '$': r'\$', '&': r'\&',
+                               '%': r'\%', '{': r'\{', '}': r'\}',
+                               '#': r'\#', '_': r'\_'})
+_ESCAPE_SET = frozenset('\\$&%{}#_')
+
 
 def escape(s):
-    s = s.replace('\\', '\\backslash')
-    s = re.sub('([$&%{}#_])', r'\\\1', s)
-    return s
+    # Most words need no escaping, return them as is
+    if _ESCAPE_SET.isdisjoint(s):
+        return s
+    return _escape_special(s)
 
 
-def print_align_table(tex_out, a1, a2=None, a_type=ALIGN_METEOR):
-    '''LaTeX generation function: use with caution'''
+@lru_cache(maxsize=4096)
+def _escape_special(s):
+    # Words with special characters recur across segments, escape each once
+    return s.translate(_ESCAPE_TABLE)
 
-    print(r'%Table start', file=tex_out)
-    # Print color declarations
+
+@lru_cache(maxsize=None)
+def color_declarations(n):
+    '''Reference word colors for a table with n reference words
+
+    The palette only depends on n, so it is computed once per length.
+    '''
+    lines = []
     r = 0.6
     g = 0.6
     b = 1.0
-    step = 0.4 / max(1, len(a1.sen2))
-    half = len(a1.sen2) / 2
-    for i in range(len(a1.sen2)):
+    step = 0.4 / max(1, n)
+    half = n / 2
+    for i in range(n):
         if i >= half:
             r += step * 1.5
             g += step * .25
@@ -187,97 +201,128 @@ def print_align_table(tex_out, a1, a2=None, a_type=ALIGN_METEOR):
             r += step * .5
             g += step * 1.0
             b -= step * .5
-        print(r'\definecolor{{ref{0}}}{{rgb}}{{{1},{2},{3}}}'.format(
-            i, min(1.0, r), min(1.0, g), min(1.0, b)), file=tex_out)
+        lines.append(rf'\definecolor{{ref{i}}}{{rgb}}'
+                     rf'{{{min(1.0, r)},{min(1.0, g)},{min(1.0, b)}}}')
+    return tuple(lines)
+
+
+def print_align_table(out, a1, a2=None, a_type=ALIGN_METEOR):
+    '''LaTeX generation function: use with caution
+
+    Lines are appended to the list out rather than written to a file.
+    '''
+
+    # Alignment fields used throughout the table
+    sen1 = a1.sen1
+    sen2 = a1.sen2
+    n1 = len(sen1)
+    n2 = len(sen2)
+    if a2:
+        sen1b = a2.sen1
+        n1b = len(sen1b)
+
+    out.append(r'%Table start')
+    # Print color declarations
+    out.extend(color_declarations(n2))
+    # Cell color of each reference word
+    ref_color = [rf'\cellcolor{{ref{i}}}' for i in range(n2)]
     # Print table start
-    line = r'\noindent\begin{tabular}{|l'
-    for i in range(len(a1.sen2)):
-        line += r'|'
-        line += r'p{10pt}'
+    line = r'\noindent\begin{tabular}{|l' + r'|p{10pt}' * n2
     if a2:
         line += r'|l'
     line += r'|}'
-    print(line, file=tex_out)
-    print(r'\hline', file=tex_out)
+    out.append(line)
+    out.append(r'\hline')
     # Print sentence 2
-    line = ''
+    parts = []
     if a2:
-        line += r'\Large\color{z}{$\blacksquare$} \color{y}{$\blacksquare$}'
-    for i in range(len(a1.sen2)):
-        w2 = escape(a1.sen2[i])
-        line += r'&\begin{sideways}' + r'\cellcolor{{ref{0}}}'.format(i) + \
-                w2 + '\hspace{12pt}\end{sideways}'
+        parts.append(r'\Large\color{z}{$\blacksquare$} \color{y}{$\blacksquare$}')
+    for i in range(n2):
+        parts.append(r'&\begin{sideways}' + ref_color[i] + escape(sen2[i]) +
+                     r'\hspace{12pt}\end{sideways}')
     if a2:
-        line += r'&\rex \rap'
-    print(line + r'\\', file=tex_out)
+        parts.append(r'&\rex \rap')
+    parts.append(r'\\')
+    out.append(''.join(parts))
     # Print each row for sentences a1.sen1, a2.sen1
-    max_len = max(len(a1.sen1), len(a2.sen1)) if a2 else len(a1.sen1)
+    max_len = max(n1, n1b) if a2 else n1
     fill1 = FILL
     if a2:
         fill1 = FILL_L
         fill2 = FILL_R
+    # Precompute cell contents, with the column separator folded into the
+    # sentence 1 cells, and sentence 1 word colors
+    sep = r'&\hspace{2pt}'
+    blank1 = [sep] * n2
+    cells1 = [[sep + fill1[c] if c else sep for c in row] for row in a1.matrix]
+    color1 = [ref_color[k] if k != NO_MATCH else '' for k in a1.sen1_matched]
+    if a2:
+        blank2 = [''] * n2
+        cells2 = [[fill2[c] if c else '' for c in row] for row in a2.matrix]
+        color2 = [ref_color[k] if k != NO_MATCH else ''
+                  for k in a2.sen1_matched]
     for i in range(max_len):
-        print(r'\hline', file=tex_out)
-        line = ''
-        if i < len(a1.sen1):
-            line += r'\ssp '
-            if a1.sen1_matched[i] != NO_MATCH:
-                line += r'\cellcolor{{ref{0}}}'.format(a1.sen1_matched[i])
-            line += escape(a1.sen1[i]) + r' \ssp'
-        for j in range(len(a1.sen2)):
-            line += r'&\hspace{2pt}'
-            if i < len(a1.sen1):
-                match = a1.matrix[i][j]
-                if match:
-                    line += fill1[a1.matrix[i][j]]
-            if a2 and i < len(a2.sen1):
-                match = a2.matrix[i][j]
-                if match:
-                    line += fill2[match]
+        out.append(r'\hline')
+        parts = []
+        row1 = blank1
+        if i < n1:
+            parts += (r'\ssp ', color1[i], escape(sen1[i]), r' \ssp')
+            row1 = cells1[i]
+        # Render all cells of the row in a single join
         if a2:
-            line += r'&'
-            if i < len(a2.sen1):
-                line += r'\ssp '
-                if a2.sen1_matched[i] != NO_MATCH:
-                    line += r'\cellcolor{{ref{0}}}'.format(a2.sen1_matched[i])
-                line += escape(a2.sen1[i]) + r'\ssp '
-        print(line + r'\\', file=tex_out)
-    print(r'\hline', file=tex_out)
+            row2 = cells2[i] if i < n1b else blank2
+            parts += map(str.__add__, row1, row2)
+            parts.append(r'&')
+            if i < n1b:
+                parts += (r'\ssp ', color2[i], escape(sen1b[i]), r'\ssp ')
+        else:
+            parts += row1
+        parts.append(r'\\')
+        out.append(''.join(parts))
+    out.append(r'\hline')
     # Print table footer
-    print(r'\end{tabular}', file=tex_out)
-    print(r'', file=tex_out)
-    print(r'\vspace{6pt}', file=tex_out)
+    out.append(r'\end{tabular}')
+    out.append(r'')
+    out.append(r'\vspace{6pt}')
     # Print alignment information
     if a_type == ALIGN_DEFAULT:
-        print(r'\noindent {0}'.format(a1.name), file=tex_out)
+        out.append(r'\noindent {0}'.format(a1.name))
     # Compare stats
     elif a_type == ALIGN_METEOR:
-        print(r'\noindent Segment {0}\\\\'.format(escape(a1.name)), file=tex_out)
+        out.append(r'\noindent Segment {0}\\\\'.format(escape(a1.name)))
         if a2:
             p_diff = a2.p - a1.p
             r_diff = a2.r - a1.r
             fr_diff = a2.frag - a1.frag
             sc_diff = a2.score - a1.score
 
-            print(r'\noindent\begin{tabular}{lm{12pt}rm{24pt}rm{24pt}r}', file=tex_out)
-            print(r'\hline', file=tex_out)
-            print(r'P:&&{0:.3f}&\centering vs&{1:.3f}&\centering :&{{\bf\color{{{2}}}{{{3:.3f}}}}}\\'.format(a1.p, a2.p, 'gb' if p_diff >= 0 else 'rb', p_diff), file=tex_out)
-            print(r'R:&&{0:.3f}&\centering vs&{1:.3f}&\centering :&{{\bf\color{{{2}}}{{{3:.3f}}}}}\\'.format(a1.r, a2.r, 'gb' if r_diff >= 0 else 'rb', r_diff), file=tex_out)
-            print(r'Frag:&&{0:.3f}&\centering vs&{1:.3f}&\centering :&{{\bf\color{{{2}}}{{{3:.3f}}}}}\\'.format(a1.frag, a2.frag, 'rb' if fr_diff > 0 else 'gb', fr_diff), file=tex_out)
-            print(r'Score:&&{0:.3f}&\centering vs&{1:.3f}&\centering :&{{\bf\color{{{2}}}{{{3:.3f}}}}}\\'.format(a1.score, a2.score, 'gb' if sc_diff >= 0 else 'rb', sc_diff), file=tex_out)
+            out.append(r'\noindent\begin{tabular}{lm{12pt}rm{24pt}rm{24pt}r}')
+            out.append(r'\hline')
+            out.append(rf'P:&&{a1.p:.3f}&\centering vs&{a2.p:.3f}&\centering :&{{\bf\color{{{"gb" if p_diff >= 0 else "rb"}}}{{{p_diff:.3f}}}}}\\')
+            out.append(rf'R:&&{a1.r:.3f}&\centering vs&{a2.r:.3f}&\centering :&{{\bf\color{{{"gb" if r_diff >= 0 else "rb"}}}{{{r_diff:.3f}}}}}\\')
+            out.append(rf'Frag:&&{a1.frag:.3f}&\centering vs&{a2.frag:.3f}&\centering :&{{\bf\color{{{"rb" if fr_diff > 0 else "gb"}}}{{{fr_diff:.3f}}}}}\\')
+            out.append(rf'Score:&&{a1.score:.3f}&\centering vs&{a2.score:.3f}&\centering :&{{\bf\color{{{"gb" if sc_diff >= 0 else "rb"}}}{{{sc_diff:.3f}}}}}\\')
         else:
-            print(r'\noindent\begin{tabular}{lm{12pt}r}', file=tex_out)
-            print(r'\hline', file=tex_out)
-            print(r'P:&&{0:.3f}\\'.format(a1.p), file=tex_out)
-            print(r'R:&&{0:.3f}\\'.format(a1.r), file=tex_out)
-            print(r'Frag:&&{0:.3f}\\'.format(a1.frag), file=tex_out)
-            print(r'Score:&&{0:.3f}\\'.format(a1.score), file=tex_out)
-        print(r'\end{tabular}', file=tex_out)
+            out.append(r'\noindent\begin{tabular}{lm{12pt}r}')
+            out.append(r'\hline')
+            out.append(rf'P:&&{a1.p:.3f}\\')
+            out.append(rf'R:&&{a1.r:.3f}\\')
+            out.append(rf'Frag:&&{a1.frag:.3f}\\')
+            out.append(rf'Score:&&{a1.score:.3f}\\')
+        out.append(r'\end{tabular}')
     # End table
-    print(r'%Table end', file=tex_out)
-    print('', file=tex_out)
-    print(r'\newpage', file=tex_out)
-    print('', file=tex_out)
+    out.append(r'%Table end')
+    out.append('')
+    out.append(r'\newpage')
+    out.append('')
+
+
+def write_lines(out_file, lines):
+    '''Stream lines to out_file through a 1MB block buffer'''
+    out = open(out_file, 'w', encoding='utf-8', newline='\n',
+               buffering=1 << 20)
+    out.writelines(line + '\n' for line in lines)
+    out.close()
 
 
 def write_plot_hist(work_dir, dat_file, plot_file, eps_file, xlabel='Score', num_data_cols=1):
@@ -292,8 +337,9 @@ def write_plot_hist(work_dir, dat_file, plot_file, eps_file, xlabel='Score', num
 
 
 def gnuplot(work_dir, plot_file):
-    subprocess.Popen([gnuplot_cmd, plot_file], cwd=work_dir,
-                     stdout=subprocess.PIPE, stderr=subprocess.PIPE).wait()
+    subprocess.run([gnuplot_cmd, plot_file], cwd=work_dir,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                   check=False)
 
 
 def get_font(uni):
@@ -338,20 +384,14 @@ def check_printable(a1, a2=None):
 
 
 def xelatex(tex_file, pdf_file, work_dir=shutil.os.curdir):
-    # Working dir
-    out_dir = tempfile.mkdtemp()
-    # PDF output file
-    if '.' in tex_file:
-        out_pdf = tex_file[0:tex_file.rfind('.')] + '.pdf'
-    else:
-        out_pdf = tex_file + '.pdf'
-    # Run xelatex
-    subprocess.Popen([xelatex_cmd, '-interaction', 'batchmode',
-                      '-output-directory', out_dir, tex_file], cwd=work_dir,
-                     stdout=subprocess.PIPE, stderr=subprocess.PIPE).wait()
-    # Copy pdf file and remove temp files
-    shutil.copyfile(shutil.os.path.join(out_dir, out_pdf), pdf_file)
-    shutil.rmtree(out_dir)
+    # PDF output file, named after the tex file without its directory
+    out_pdf = shutil.os.path.splitext(shutil.os.path.basename(tex_file))[0] + '.pdf'
+    # Run xelatex, output and aux files are written to the working dir
+    subprocess.run([xelatex_cmd, '-interaction', 'batchmode', tex_file],
+                   cwd=work_dir, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL, check=False)
+    # Move pdf file in place
+    shutil.os.replace(shutil.os.path.join(work_dir, out_pdf), pdf_file)
 
 
 def main(argv):
@@ -373,20 +413,17 @@ def main(argv):
 
     alignments = read_align_file(align_file, max_align=max_align, a_type=ALIGN_DEFAULT)
 
-    tex_out = open(tex_file, 'w')
-    print(DEC_HEADER1, file=tex_out)
-    print(get_font(True), file=tex_out)
-    print(DEC_HEADER2, file=tex_out)
-    print(DOC_HEADER_ALIGN, file=tex_out)
+    # Buffer tex lines and write them out in one go
+    tex_lines = [DEC_HEADER1, get_font(True), DEC_HEADER2, DOC_HEADER_ALIGN]
     for i in range(len(alignments)):
         a = alignments[i]
         if not check_printable(a):
             continue
-        print_align_table(tex_out, a, a_type=ALIGN_DEFAULT)
+        print_align_table(tex_lines, a, a_type=ALIGN_DEFAULT)
     # Print footer
-    print(DOC_FOOTER, file=tex_out)
-    # Close file
-    tex_out.close()
+    tex_lines.append(DOC_FOOTER)
+    # Write file
+    write_lines(tex_file, tex_lines)
     print('Compiling {0} - this may take a few minutes...'.format(pdf_file), file=sys.stderr)
     xelatex(tex_file, pdf_file)
 
@@ -4,7 +4,8 @@ import os
 import sys
 import shutil
 import optparse
-from functools import cmp_to_key
+from operator import attrgetter
+from concurrent.futures import ThreadPoolExecutor
 
 # from alignment import *
 from visualize import check_gnuplot, check_printable, check_xelatex
@@ -12,25 +13,43 @@ from visualize import gnuplot, xelatex
 from visualize import DOC_HEADER_COMPARE, DOC_HEADER_SINGLE
 from visualize import DEC_HEADER1, DEC_HEADER2, DOC_FOOTER
 from visualize import get_font, write_plot_hist, print_align_table
-from alignment import cmp_score, cmp_score_best, cmp_score_diff, extract_scores
+from visualize import write_lines
+from alignment import key_score, key_score_best, key_score_diff, extract_scores
 from alignment import read_align_file, get_score_dist
 
 
+ROW_LABEL = ['0.0-0.1', '0.1-0.2', '0.2-0.3', '0.3-0.4',
+             '0.4-0.5', '0.5-0.6', '0.6-0.7', '0.7-0.8',
+             '0.8-0.9', '0.9-1.0']
+
+STATS = ('score', 'frag', 'p', 'r')
+get_stats = attrgetter(*STATS)
+
+
+def get_stat_dists(seg_groups):
+    '''Score distributions of every stat for each group of segments
+
+    Each group is traversed once, returns {stat: [dist for each group]}.
+    '''
+    dists = {stat: [] for stat in STATS}
+    for segments in seg_groups:
+        values = list(zip(*map(get_stats, segments))) or [()] * len(STATS)
+        for stat, v in zip(STATS, values):
+            dists[stat].append(get_score_dist(v))
+    return dists
+
+
 def write_dat_file(dat_file, data, xlabel='Score', syslabels=None):
-    ROW_LABEL = ['0.0-0.1', '0.1-0.2', '0.2-0.3', '0.3-0.4',
-                 '0.4-0.5', '0.5-0.6', '0.6-0.7', '0.7-0.8',
-                 '0.8-0.9', '0.9-1.0']
     col_label = [xlabel[0].upper() + xlabel[1:]]
     for i in range(len(data)):
         if syslabels and len(syslabels) > i:
             col_label.append(syslabels[i])
         else:
             col_label.append('System-{0}'.format(i + 1))
-    dat_out = open(dat_file, 'w')
-    print('\t'.join(col_label), file=dat_out)
-    for row in zip(ROW_LABEL, list(zip(*data))):
-        print(row[0] + '\t' + '\t'.join([str(x) for x in row[1]]), file=dat_out)
-    dat_out.close()
+    rows = ['\t'.join(col_label)]
+    for row in zip(ROW_LABEL, *data):
+        rows.append('\t'.join(map(str, row)))
+    write_lines(dat_file, rows)
 
 
 def main(argv):
@@ -90,6 +109,10 @@ def main(argv):
     for i in range(len(label_list), len(a)):
         label_list.append('System-{0}'.format(i + 1))
 
+    # Compiling pdf files and plots is independent, run jobs in parallel
+    executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+    jobs = []
+
     pre_dir = prefix + '-files'
     try:
         os.mkdir(pre_dir)
@@ -111,23 +134,18 @@ def main(argv):
         pdf_file = prefix + '-align.pdf'
         tex_file = 'align.tex'
         # Read alignments
-        align_1 = read_align_file(a[0], max_align)
-        align_2 = read_align_file(a[1], max_align)
+        align_1, align_2 = executor.map(read_align_file, a[:2],
+                                        [max_align] * 2)
         seg_scores.append(extract_scores(align_1))
         seg_scores.append(extract_scores(align_2))
         alignments = list(zip(align_1, align_2))
-        alignments.sort(
-            key=cmp_to_key(cmp_score_best if best_first else cmp_score_diff),
-            reverse=True)
+        alignments.sort(key=key_score_best if best_first else key_score_diff,
+                        reverse=True)
         if not no_align:
-            # Write tex file
-            tex_out = open(os.path.join(pre_dir, tex_file), 'w')
             # Header
-            print(DEC_HEADER1, file=tex_out)
-            print(get_font(uni), file=tex_out)
-            print(DEC_HEADER2, file=tex_out)
-            print(DOC_HEADER_COMPARE.format(sys1=label_list[0],
-                  sys2=label_list[1]), file=tex_out)
+            tex_lines = [DEC_HEADER1, get_font(uni), DEC_HEADER2,
+                         DOC_HEADER_COMPARE.format(sys1=label_list[0],
+                                                   sys2=label_list[1])]
             # Print each alignment
             for i in range(len(alignments)):
                 a1, a2 = alignments[i]
@@ -136,33 +154,33 @@ def main(argv):
                     a2.rtl()
                 if not check_printable(a1, a2):
                     continue
-                print_align_table(tex_out, a1, a2)
+                print_align_table(tex_lines, a1, a2)
             # Print footer
-            print(DOC_FOOTER, file=tex_out)
-            # Close file
-            tex_out.close()
+            tex_lines.append(DOC_FOOTER)
+            # Write tex file
+            write_lines(os.path.join(pre_dir, tex_file), tex_lines)
             # Compile pdf file
             print('Compiling {0} - this may take a few minutes...'.format(pdf_file), file=sys.stderr)
-            xelatex(tex_file, pdf_file, work_dir=pre_dir)
+            jobs.append(executor.submit(xelatex, tex_file, pdf_file,
+                                        work_dir=pre_dir))
     # Write N individual alignment files
     else:
+        # Read all alignment files in the background
+        reads = [executor.submit(read_align_file, f, max_align)
+                 for f in align_files]
         for i in range(len(align_files)):
             # Out files
             pdf_file = '{0}-align-{1}.pdf'.format(prefix, label_list[i].lower())
             tex_file = 'align-{1}.tex'.format(prefix, i + 1)
             # Read alignments
-            alignments = read_align_file(a[i], max_align)
+            alignments = reads[i].result()
             seg_scores.append(extract_scores(alignments))
-            alignments.sort(key=cmp_to_key(cmp_score), reverse=True)
+            alignments.sort(key=key_score, reverse=True)
             if no_align:
                 continue
-            # Write tex file
-            tex_out = open(os.path.join(pre_dir, tex_file), 'w')
             # Header
-            print(DEC_HEADER1, file=tex_out)
-            print(get_font(uni), file=tex_out)
-            print(DEC_HEADER2, file=tex_out)
-            print(DOC_HEADER_SINGLE.format(sysname=label_list[i]), file=tex_out)
+            tex_lines = [DEC_HEADER1, get_font(uni), DEC_HEADER2,
+                         DOC_HEADER_SINGLE.format(sysname=label_list[i])]
             # Print each alignment
             for i in range(len(alignments)):
                 a1 = alignments[i]
@@ -170,61 +188,76 @@ def main(argv):
                     a1.rtl()
                 if not check_printable(a1):
                     continue
-                print_align_table(tex_out, a1)
+                print_align_table(tex_lines, a1)
             # Print footer
-            print(DOC_FOOTER, file=tex_out)
-            # Close file
-            tex_out.close()
+            tex_lines.append(DOC_FOOTER)
+            # Write tex file
+            write_lines(os.path.join(pre_dir, tex_file), tex_lines)
             # Compile pdf file
             print('Compiling {0} - this may take a few minutes...'.format(pdf_file), file=sys.stderr)
-            xelatex(tex_file, pdf_file, work_dir=pre_dir)
+            jobs.append(executor.submit(xelatex, tex_file, pdf_file,
+                                        work_dir=pre_dir))
 
     #
     # Graph scores
     #
 
+    plots = []
+
     # All scores
-    for stat in ('score', 'frag', 'p', 'r'):
+    dists = get_stat_dists(seg_scores)
+    for stat in STATS:
         dat_file = '{0}-all.dat'.format(stat)
         plot_file = '{0}-all.plot'.format(stat)
         eps_file = '{0}-all.eps'.format(stat)
-        dists = []
-        for scores in seg_scores:
-            dists.append(get_score_dist([eval('x.' + stat) for x in scores]))
-        write_dat_file(os.path.join(pre_dir, dat_file), dists, stat,
+        write_dat_file(os.path.join(pre_dir, dat_file), dists[stat], stat,
                        label_list)
-        write_plot_hist(pre_dir, dat_file, plot_file, eps_file, stat, len(dists))
-        gnuplot(pre_dir, plot_file)
+        write_plot_hist(pre_dir, dat_file, plot_file, eps_file, stat,
+                        len(dists[stat]))
+        plots.append(executor.submit(gnuplot, pre_dir, plot_file))
 
     # Scores by length
-    for stat in ('score', 'frag', 'p', 'r'):
-        for r in [[1, 10], [11, 25], [26, 50], [51]]:
-            if len(r) == 2:
-                label = '{0}-{1}'.format(r[0], r[1])
-            else:
-                label = '{0}+'.format(r[0])
+    len_ranges = [[1, 10], [11, 25], [26, 50], [51]]
+    # Split each system's segments into length buckets once for all stats
+    len_buckets = []
+    for scores in seg_scores:
+        buckets = [[] for r in len_ranges]
+        for x in scores:
+            for k, r in enumerate(len_ranges):
+                if x.sen_len >= r[0] and (len(r) == 1 or x.sen_len <= r[1]):
+                    buckets[k].append(x)
+        len_buckets.append(buckets)
+    for k, r in enumerate(len_ranges):
+        if len(r) == 2:
+            label = '{0}-{1}'.format(r[0], r[1])
+        else:
+            label = '{0}+'.format(r[0])
+        dists = get_stat_dists([buckets[k] for buckets in len_buckets])
+        for stat in STATS:
             dat_file = '{0}-{1}.dat'.format(stat, label)
             plot_file = '{0}-{1}.plot'.format(stat, label)
             eps_file = '{0}-{1}.eps'.format(stat, label)
-            dists = []
-            for scores in seg_scores:
-                if len(r) == 2:
-                    values = [eval('x.' + stat) for x in scores if x.sen_len >= r[0] and x.sen_len <= r[1]]
-                else:
-                    values = [eval('x.' + stat) for x in scores if x.sen_len >= r[0]]
-                dists.append(get_score_dist(values))
-            write_dat_file(os.path.join(pre_dir, dat_file), dists,
+            write_dat_file(os.path.join(pre_dir, dat_file), dists[stat],
                            stat, label_list)
-            write_plot_hist(pre_dir, dat_file, plot_file, eps_file, stat, len(dists))
-            gnuplot(pre_dir, plot_file)
+            write_plot_hist(pre_dir, dat_file, plot_file, eps_file, stat,
+                            len(dists[stat]))
+            plots.append(executor.submit(gnuplot, pre_dir, plot_file))
 
     # Write files
     score_pdf = prefix + '-score.pdf'
     score_tex = 'score.tex'
     shutil.copyfile(os.path.join(os.path.dirname(__file__),
                     'score_template.tex'), os.path.join(pre_dir, score_tex))
+    # Score pdf includes the plots
+    for plot in plots:
+        plot.result()
     print('Compiling {0}...'.format(score_pdf), file=sys.stderr)
-    xelatex(score_tex, score_pdf, work_dir=pre_dir)
+    jobs.append(executor.submit(xelatex, score_tex, score_pdf,
+                                work_dir=pre_dir))
+    # Wait for all compilations to finish
+    for job in jobs:
+        job.result()
+    executor.shutdown()
     print('Supporting files written to {0}.'.format(pre_dir), file=sys.stderr)
 
 